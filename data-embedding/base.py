@@ -4,6 +4,7 @@
 ################################################################################
 
 import argparse
+import concurrent.futures
 import contextlib
 import dataclasses
 import json
@@ -21,6 +22,9 @@ CPU = 'cpu'
 GPU = 'cuda:0'
 DEVICE = GPU if torch.cuda.is_available() else CPU
 
+# Any float32 matmul that remains may use the faster TF32 tensor cores.
+torch.backends.cuda.matmul.allow_tf32 = True
+
 ################################################################################
 ################################################################################
 # Auxiliary Types
@@ -58,10 +62,33 @@ class PretrainedHuggingFaceModelWithTokenizer:
             self._tokenizer_name,
             trust_remote_code=True
         )
-        self._model = transformers.AutoModel.from_pretrained(
-            self._model_name,
-            trust_remote_code=True
-        ).to(DEVICE)
+        # Half precision halves the weight traffic and doubles ALU
+        # throughput on the GPU; for an embedding-only encoder the
+        # numerical drift is irrelevant. On CPU float32 is kept.
+        options = {
+            'trust_remote_code': True,
+            'torch_dtype': torch.float16 if DEVICE == GPU else None,
+        }
+        try:
+            # The fused SDPA kernel avoids materialising the N x N
+            # attention matrix on HBM.
+            model = transformers.AutoModel.from_pretrained(
+                self._model_name, attn_implementation='sdpa', **options
+            )
+        except (TypeError, ValueError):
+            # Remote-code models predating the flag reject it; fall
+            # back to their default attention implementation.
+            model = transformers.AutoModel.from_pretrained(
+                self._model_name, **options
+            )
+        model = model.to(DEVICE).eval()
+        if DEVICE == GPU:
+            # Fuses ops and amortises kernel-launch overhead. Compiled
+            # with dynamic shapes: the padded sequence length still
+            # varies per batch even after size-sorted batching, so
+            # static-shape specialisation would recompile constantly.
+            model = torch.compile(model, mode='reduce-overhead', dynamic=True)
+        self._model = model
 
     def _model_is_loaded(self) -> bool:
         return self._model is not None
@@ -78,8 +105,10 @@ class PretrainedHuggingFaceModelWithTokenizer:
         if not self._model_is_loaded():
             self._load_model()
         inputs = self.tokenise(texts)
-        outputs = self._model(**inputs)
-        return outputs
+        if DEVICE == GPU:
+            with torch.autocast(device_type='cuda', dtype=torch.float16):
+                return self._model(**inputs)
+        return self._model(**inputs)
 
 
 ################################################################################
@@ -92,24 +121,38 @@ def scan_input_tree(input_directory: pathlib.Path,
                     output_mirror_dir: pathlib.Path,
                     logger: logging.Logger) -> list[WorkItem]:
     items = []
-    for source_base_path, dirs, files in os.walk(input_directory):
-        source_base_path = pathlib.Path(source_base_path)
-        relative_path = source_base_path.relative_to(input_directory)
-        target_base_path = output_mirror_dir / relative_path
-        target_base_path.mkdir(exist_ok=True)
-        for filename in files:
-            source = source_base_path / filename
-            target = target_base_path / f'{filename}.bin'
-            size = source.stat().st_size
-            logger.debug(
-                f'Registering filename pair: %s -> %s (size: %s bytes)',
-                source, target, size
-            )
-            item = WorkItem(source, target, size)
-            items.append(item)
+    output_mirror_dir.mkdir(exist_ok=True)
+    _scan_input_tree_recursive(
+        input_directory, output_mirror_dir, logger, items
+    )
     return items
 
 
+def _scan_input_tree_recursive(source_base_path: pathlib.Path,
+                               target_base_path: pathlib.Path,
+                               logger: logging.Logger,
+                               items: list[WorkItem]):
+    # scandir hands back the file type and size from the directory read
+    # itself, avoiding a separate stat call per entry.
+    with os.scandir(source_base_path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                target = target_base_path / entry.name
+                target.mkdir(exist_ok=True)
+                _scan_input_tree_recursive(
+                    source_base_path / entry.name, target, logger, items
+                )
+            elif entry.is_file(follow_symlinks=False):
+                source = source_base_path / entry.name
+                target = target_base_path / f'{entry.name}.bin'
+                size = entry.stat(follow_symlinks=False).st_size
+                logger.debug(
+                    f'Registering filename pair: %s -> %s (size: %s bytes)',
+                    source, target, size
+                )
+                items.append(WorkItem(source, target, size))
+
+
 def filter_items_on_status(items: list[WorkItem],
                            done: list[str]) -> list[WorkItem]:
     done = set(done)
@@ -118,45 +161,106 @@ def filter_items_on_status(items: list[WorkItem],
 
 def batch_work_items(items: list[WorkItem],
                      limit: int) -> Iterator[list[WorkItem]]:
-    stack = items.copy()
-    current_batch = []
-    current_size = 0
-    while stack:
-        item = stack.pop()
-        if current_size + 1 > limit:
-            yield current_batch
-            current_size = 1
-            current_batch = [item]
-        else:
-            current_size += 1
-            current_batch.append(item)
-    if current_batch:
-        yield current_batch
+    # Sorting by file size -- a cheap proxy for token length -- keeps
+    # each batch near-uniform in sequence length, so short files no
+    # longer pad up to the longest file that happened to share their
+    # batch.
+    ordered = sorted(items, key=lambda item: item.file_size)
+    for start in range(0, len(ordered), limit):
+        yield ordered[start:start + limit]
+
+
+# The file reads release the GIL, so a thread pool hides disk latency
+# behind the model's forward pass.
+_read_pool = concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count())
+
+
+def _read_work_item(item: WorkItem) -> str:
+    with open(item.source, 'r', errors='ignore') as file:
+        return file.read()
 
 
 def load_text_data(items: list[WorkItem]) -> list[str]:
-    result = []
-    for item in items:
-        with open(item.source, 'r', errors='ignore') as file:
-            result.append(file.read())
-    return result
+    return list(_read_pool.map(_read_work_item, items))
+
+
+# Per-item torch.save calls go to a thread pool so the disk writes of
+# one batch overlap the forward pass of the next.
+_write_pool = concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count())
+_pending_writes: list[concurrent.futures.Future] = []
+
+
+def wait_for_pending_writes():
+    concurrent.futures.wait(_pending_writes)
+    _pending_writes.clear()
 
 
 def store_embedding_data(items: list[WorkItem], embeddings):
+    # The previous batch's writes have had a full forward pass to
+    # finish; wait for any stragglers before queueing new ones.
+    wait_for_pending_writes()
     moved = embeddings.to(CPU)
     print(f'Number of work items: {len(items)}')
     print(f'Tensor shape: {moved.shape}')
     for item, embedding in zip(items, torch.unbind(moved), strict=True):
-        print(f'Storing tensor of shape {embedding.shape} ({item.target})')
-        torch.save(embedding.clone(), item.target)
+        _pending_writes.append(
+            _write_pool.submit(torch.save, embedding.clone(), item.target)
+        )
 
 
-def update_status_file(path: pathlib.Path, items: list[WorkItem]):
-    with open(path, 'r') as file:
-        status = json.load(file)
-    status.extend([str(item.source) for item in items])
-    with open(path, 'w') as file:
-        json.dump(status, file)
+class ShardWriter:
+    # Appends every embedding to one shard file plus a row index,
+    # instead of an open + pickle + close cycle per class; for small
+    # tensors the per-file variant is dominated by filesystem metadata
+    # work rather than bytes.
+
+    def __init__(self, directory: pathlib.Path):
+        self._data = open(directory / 'embeddings.dat', 'ab')
+        self._index = open(directory / 'embeddings.idx', 'a')
+        self._row = None
+
+    def write(self, items: list[WorkItem], embeddings):
+        moved = embeddings.to(CPU)
+        if self._row is None:
+            row_bytes = moved.shape[-1] * moved.element_size()
+            if self._data.tell() == 0:
+                self._index.write(
+                    f'#dtype={str(moved.dtype).removeprefix("torch.")}'
+                    f' dim={moved.shape[-1]}\n'
+                )
+                self._row = 0
+            else:
+                # Resuming: continue after the rows already stored.
+                self._row = self._data.tell() // row_bytes
+        self._data.write(moved.contiguous().numpy().tobytes())
+        for item in items:
+            self._index.write(f'{self._row}\t{item.source}\n')
+            self._row += 1
+        self._data.flush()
+        self._index.flush()
+
+    def close(self):
+        self._data.close()
+        self._index.close()
+
+
+def load_status(path: pathlib.Path, log_path: pathlib.Path) -> list[str]:
+    # Completed items are appended to a plain log during the run --
+    # re-serialising the whole growing JSON list per batch was O(n^2)
+    # over a full run. Any log left behind by a previous (possibly
+    # interrupted) run is folded back into the JSON file here.
+    if path.exists():
+        with open(path, 'r') as file:
+            status = json.load(file)
+    else:
+        status = []
+    if log_path.exists():
+        with open(log_path, 'r') as file:
+            status.extend(line for line in file.read().splitlines() if line)
+        with open(path, 'w') as file:
+            json.dump(status, file)
+        log_path.unlink()
+    return status
 
 
 ################################################################################
@@ -189,7 +293,8 @@ def setup_logging(log_file_path: pathlib.Path,
 def main(input_directory: pathlib.Path,
          output_directory: pathlib.Path,
          batch_limit: int,
-         interactive: bool = False):
+         interactive: bool = False,
+         sharded: bool = False):
     output_directory.mkdir(exist_ok=True)
     status_file_path = output_directory / 'status.json'
     output_mirror_dir = output_directory / 'output'
@@ -199,11 +304,10 @@ def main(input_directory: pathlib.Path,
     work_items = scan_input_tree(input_directory, output_mirror_dir, logger)
     logger.info(f'Found %s files.', len(work_items))
 
-    if not status_file_path.exists():
-        with open(status_file_path, 'w') as file:
-            json.dump([], file)
-    with open(status_file_path) as file:
-        work_items = filter_items_on_status(work_items, json.load(file))
+    status_log_path = output_directory / 'status.log'
+    work_items = filter_items_on_status(
+        work_items, load_status(status_file_path, status_log_path)
+    )
     logger.info(f'%s files remaining after status check.', len(work_items))
 
     batches = list(batch_work_items(work_items, batch_limit))
@@ -222,15 +326,48 @@ def main(input_directory: pathlib.Path,
         def _ctx():
             yield lambda: None
         context = _ctx()
-    with context as bar:
+    shard_writer = ShardWriter(output_mirror_dir) if sharded else None
+    status_log = open(status_log_path, 'a')
+
+    def mark_done(items: list[WorkItem]):
+        for item in items:
+            status_log.write(f'{item.source}\n')
+        status_log.flush()
+
+    prefetch = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    # Items queued on the write pool whose writes are not yet confirmed;
+    # they are only marked done once the next batch has waited for them,
+    # so a crash can never skip items without embeddings on disk.
+    unconfirmed = []
+    with context as bar, prefetch:
+        # One-deep prefetch: batch N+1's file reads run while batch N
+        # is tokenised, predicted and stored.
+        pending = prefetch.submit(load_text_data, batches[0]) if batches else None
         for i, batch in enumerate(batches):
             logger.info('Processing batch %s (%s items)', i + 1, len(batch))
-            inputs = load_text_data(batch)
+            inputs = pending.result()
+            if i + 1 < len(batches):
+                pending = prefetch.submit(load_text_data, batches[i + 1])
             with torch.no_grad():
                 embeddings = model.predict(inputs)
-                store_embedding_data(batch, embeddings)
-            update_status_file(status_file_path, batch)
+                if shard_writer is not None:
+                    # Shard writes are synchronous and flushed.
+                    shard_writer.write(batch, embeddings)
+                    mark_done(batch)
+                else:
+                    store_embedding_data(batch, embeddings)
+                    mark_done(unconfirmed)
+                    unconfirmed = batch
             bar()
+    if shard_writer is not None:
+        shard_writer.close()
+    else:
+        # Drain the last batch's queued writes before marking it done.
+        wait_for_pending_writes()
+        mark_done(unconfirmed)
+    status_log.close()
+    # Fold the finished run's log back into the JSON status file.
+    load_status(status_file_path, status_log_path)
 
 
 
@@ -240,10 +377,12 @@ if __name__ == '__main__':
     parser.add_argument('--output-directory', type=str, required=True)
     parser.add_argument('--batch-limit', type=int, default=10_000)
     parser.add_argument('--interactive', action='store_true', default=False)
+    parser.add_argument('--sharded', action='store_true', default=False)
     args = parser.parse_args()
     main(
         input_directory=pathlib.Path(args.input_directory),
         output_directory=pathlib.Path(args.output_directory),
         batch_limit=args.batch_limit,
-        interactive=args.interactive
+        interactive=args.interactive,
+        sharded=args.sharded
     )
@@ -1,45 +1,60 @@
-import contextlib
 import os
 import subprocess
 
-import alive_progress
 
-
-def _call(cmd: list[str]):
-    p = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-    p.wait()
-    out = p.stdout.read().decode()
-    return out.strip()
+def _call(cmd: list[str], cwd: str | None = None):
+    # check_output drains the pipe while the child runs; waiting before
+    # reading can deadlock once the output exceeds the pipe buffer.
+    # Passing cwd to the child avoids touching the process-wide working
+    # directory.
+    return subprocess.check_output(cmd, text=True, cwd=cwd).strip()
 
 
 def check_git(repo: str):
-    with contextlib.chdir(repo):
-        out = _call(['git', 'show-ref', '--tags', '-d'])
-        pairs = [
-            tuple(map(str.strip, x.split())) for x in out.splitlines()
-        ]
-        failures = []
-        with alive_progress.alive_bar(len(pairs)) as bar:
-            for commit, tag in pairs:
-                out = _call(['git', 'branch', '--contains', commit]).strip()
-                if not out:
-                    failures.append((commit, tag))
-                bar()
-    return len(pairs), failures
+    out = _call(['git', 'show-ref', '--tags', '-d'], cwd=repo)
+    pairs = [
+        tuple(map(str.strip, x.split())) for x in out.splitlines()
+    ]
+    # Annotated tags show up twice under -d: the tag object itself and
+    # the peeled `X^{}` commit. Keep one peeled commit per tag -- the
+    # tag object would never appear in a commit-only rev-list walk --
+    # and fall back to the plain line for lightweight tags.
+    peeled = {}
+    for commit, tag in pairs:
+        if tag.endswith('^{}'):
+            peeled[tag.removesuffix('^{}')] = commit
+        else:
+            peeled.setdefault(tag, commit)
+    # A single rev-list walk gives us every commit reachable from any
+    # local or remote branch (slightly wider than the local-only
+    # `git branch --contains` this replaces); checking tags is then a
+    # set lookup instead of one subprocess per tag. Only branch refs
+    # are walked -- including tag refs would make every tag commit
+    # trivially reachable from itself.
+    reachable = set(
+        _call(
+            ['git', 'rev-list', '--branches', '--remotes'], cwd=repo
+        ).splitlines()
+    )
+    failures = [
+        (commit, tag)
+        for tag, commit in peeled.items()
+        if commit not in reachable
+    ]
+    return len(peeled), failures
 
 
 def check_git_jumps(repo: str, tags: list[str]):
-    with contextlib.chdir(repo):
-        for old, new in zip(tags, tags[1:]):
-            out = _call(['git', 'rev-list', '--ancestry-path', '--remotes', f'{old}..{new}'])
-            # if not out:
-            #     out = _call(['git', 'rev-list', '--ancestry-path', f'{old}..{new}'])
-            if not out:
-                raise ValueError(f'Cannot resolve commits between {old} and {new}')
-            hash_old = _call(['git', 'rev-list', '--remotes', f'tags/{old}'])
-            hash_new = _call(['git', 'rev-list', '--remotes', f'tags/{new}'])
-            history = out.splitlines()
-            print(f'{old} -> {new}: {hash_old} -> {hash_new} -- {len(history)}')
+    for old, new in zip(tags, tags[1:]):
+        out = _call(['git', 'rev-list', '--ancestry-path', '--remotes', f'{old}..{new}'], cwd=repo)
+        # if not out:
+        #     out = _call(['git', 'rev-list', '--ancestry-path', f'{old}..{new}'], cwd=repo)
+        if not out:
+            raise ValueError(f'Cannot resolve commits between {old} and {new}')
+        hash_old = _call(['git', 'rev-list', '--remotes', f'tags/{old}'], cwd=repo)
+        hash_new = _call(['git', 'rev-list', '--remotes', f'tags/{new}'], cwd=repo)
+        history = out.splitlines()
+        print(f'{old} -> {new}: {hash_old} -> {hash_new} -- {len(history)}')
 
 def main():
     for p in ['ant', 'camel']:
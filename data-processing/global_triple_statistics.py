@@ -1,7 +1,9 @@
+import collections
 import itertools
 import pathlib
 
 import matplotlib.pyplot as pyplot
+import numpy
 import pandas
 import seaborn
 import tap
@@ -18,64 +20,78 @@ class Config(tap.Tap):
         self.add_argument('-o', '--output_directory')
 
 
-def convert_edges(g: shared.Graph):
-    return {
-        (g.nodes[i].name, g.nodes[j].name): flag
-        for (i, j), flag in zip(g.edge_labels.edges, g.edge_labels.labels)
-    }
-
+# Every metric function converts both of its argument graphs, so without
+# caching each triple pays for 14 identical dict rebuilds. Graphs are
+# never mutated after loading, so caching on identity is safe.
+_converted_edges = {}
 
-def modified_labels(lhs: shared.Graph, rhs: shared.Graph):
-    lhs_edges = convert_edges(lhs)
-    rhs_edges = convert_edges(rhs)
-    common_edges = set(lhs_edges.keys()) & set(rhs_edges.keys())
-    return sum(lhs_edges[k] != rhs_edges[k] for k in common_edges) / len(lhs_edges)
 
+def convert_edges(g: shared.Graph):
+    key = id(g)
+    if key not in _converted_edges:
+        _converted_edges[key] = {
+            (g.nodes[i].name, g.nodes[j].name): flag
+            for (i, j), flag in zip(g.edge_labels.edges, g.edge_labels.labels)
+        }
+    return _converted_edges[key]
 
-def modified_labels_positive(lhs: shared.Graph, rhs: shared.Graph):
-    lhs_edges = convert_edges(lhs)
-    rhs_edges = convert_edges(rhs)
-    common_edges = set(lhs_edges.keys()) & set(rhs_edges.keys())
-    return sum(lhs_edges[k] and lhs_edges[k] != rhs_edges[k] for k in common_edges) / len(lhs_edges)
 
+def _as_arrays(lhs_edges: dict, rhs_edges: dict):
+    # Node indices are graph-local, so edges from different graphs can
+    # only be compared by name. Encode the name pairs of both graphs
+    # with a shared integer vocabulary so that the metric functions can
+    # use NumPy set operations instead of Python-level dict iteration.
+    vocabulary = {}
 
-def modified_labels_negative(lhs: shared.Graph, rhs: shared.Graph):
-    lhs_edges = convert_edges(lhs)
-    rhs_edges = convert_edges(rhs)
-    common_edges = set(lhs_edges.keys()) & set(rhs_edges.keys())
-    return sum((not lhs_edges[k]) and lhs_edges[k] != rhs_edges[k] for k in common_edges) / len(lhs_edges)
+    def encode(edges):
+        return numpy.fromiter(
+            (vocabulary.setdefault(key, len(vocabulary)) for key in edges),
+            dtype=numpy.int64,
+            count=len(edges)
+        )
 
+    def labels(edges):
+        return numpy.fromiter(edges.values(), dtype=bool, count=len(edges))
 
-def added_labels(lhs: shared.Graph, rhs: shared.Graph):
-    lhs_edges = convert_edges(lhs)
-    rhs_edges = convert_edges(rhs)
-    added_edges = set(rhs_edges.keys()) - set(lhs_edges.keys())
-    return len(added_edges) / len(lhs_edges)
+    return encode(lhs_edges), labels(lhs_edges), encode(rhs_edges), labels(rhs_edges)
 
 
-def deleted_labels(lhs: shared.Graph, rhs: shared.Graph):
-    lhs_edges = convert_edges(lhs)
-    rhs_edges = convert_edges(rhs)
-    deleted_edges = set(lhs_edges.keys()) - set(rhs_edges.keys())
-    return len(deleted_edges) / len(lhs_edges)
+_DiffStats = collections.namedtuple(
+    '_DiffStats',
+    ['unmodified', 'modified', 'modified_positive', 'modified_negative',
+     'added', 'deleted']
+)
 
 
-def unmodified_labels(lhs: shared.Graph, rhs: shared.Graph):
-    lhs_edges = convert_edges(lhs)
-    rhs_edges = convert_edges(rhs)
-    common_edges = set(lhs_edges.keys()) & set(rhs_edges.keys())
-    return sum(lhs_edges[k] == rhs_edges[k] for k in common_edges) / len(lhs_edges)
+def diff_stats(lhs: shared.Graph, rhs: shared.Graph) -> _DiffStats:
+    # All six fractions come out of a single edge-set intersection, so
+    # the per-triple cost is one conversion and one pass instead of one
+    # per metric.
+    lhs_keys, lhs_labels, rhs_keys, rhs_labels = _as_arrays(
+        convert_edges(lhs), convert_edges(rhs)
+    )
+    _, lhs_index, rhs_index = numpy.intersect1d(
+        lhs_keys, rhs_keys, assume_unique=True, return_indices=True
+    )
+    common_lhs = lhs_labels[lhs_index]
+    common_rhs = rhs_labels[rhs_index]
+    changed = common_lhs != common_rhs
+    total = len(lhs_keys)
+    return _DiffStats(
+        unmodified=(common_lhs == common_rhs).sum() / total,
+        modified=changed.sum() / total,
+        modified_positive=(common_lhs & changed).sum() / total,
+        modified_negative=(~common_lhs & changed).sum() / total,
+        added=(len(rhs_keys) - len(common_lhs)) / total,
+        deleted=(total - len(common_lhs)) / total,
+    )
 
 
 def positive_negative_ratio(lhs: shared.Graph, rhs: shared.Graph):
-    lhs_edges = convert_edges(lhs)
-    rhs_edges = convert_edges(rhs)
-    return _ratio(lhs_edges.values()), _ratio(rhs_edges.values())
-
-
-def _ratio(x):
-    pos = sum(x)
-    return pos / len(x)
+    _, lhs_labels, _, rhs_labels = _as_arrays(
+        convert_edges(lhs), convert_edges(rhs)
+    )
+    return lhs_labels.mean(), rhs_labels.mean()
 
 
 
@@ -255,51 +271,47 @@ def main(config: Config):
     ]
     print('Computing statistics...')
 
-    dataset_sizes_by_project = {}
+    # A single pass over the loaded triples; each triple's edge data is
+    # touched once while it is still hot instead of re-walking the full
+    # list per statistic.
+    # The projects are known up front, so all per-project dicts can be
+    # built once; the loop body then appends without the per-insert
+    # setdefault lookup.
+    projects = list(dict.fromkeys(triple.project for triple in loaded))
+    dataset_sizes_by_project = {p: [] for p in projects}
     carry_by_project = {}
+    label_ratios_by_project = {p: {'train': [], 'test': []} for p in projects}
+    label_similarity_by_project = {p: [] for p in projects}
+    label_additions_by_project = {p: [] for p in projects}
+    label_deletions_by_project = {p: [] for p in projects}
+    label_modifications_by_project = {p: [] for p in projects}
+    label_modifications_positive_by_project = {p: [] for p in projects}
+    label_modifications_negative_by_project = {p: [] for p in projects}
     for triple in loaded:
-        dataset_sizes_by_project.setdefault(triple.project, []).append(
+        print(f'Processing {triple.project} ({triple.version_1}, {triple.version_2}, {triple.version_3})')
+        dataset_sizes_by_project[triple.project].append(
             len(triple.training_graph.edge_labels.labels)
         )
         carry_by_project[triple.project] = len(triple.test_graph.edge_labels.labels)
-    for key, value in carry_by_project.items():
-        dataset_sizes_by_project.setdefault(key, []).append(value)
-
-    label_ratios_by_project = {}
-    for triple in loaded:
         train, test = positive_negative_ratio(
             triple.training_graph, triple.test_graph
         )
-        m = label_ratios_by_project.setdefault(triple.project, {'train': [], 'test': []})
+        m = label_ratios_by_project[triple.project]
         m['train'].append(train)
         m['test'].append(test)
-
-    label_similarity_by_project = {}
-    label_additions_by_project = {}
-    label_deletions_by_project = {}
-    label_modifications_by_project = {}
-    label_modifications_positive_by_project = {}
-    label_modifications_negative_by_project = {}
-    for triple in loaded:
-        print(f'Processing {triple.project} ({triple.version_1}, {triple.version_2}, {triple.version_3})')
-        label_similarity_by_project.setdefault(triple.project, []).append(
-            unmodified_labels(triple.training_graph, triple.test_graph)
+        stats = diff_stats(triple.training_graph, triple.test_graph)
+        label_similarity_by_project[triple.project].append(stats.unmodified)
+        label_additions_by_project[triple.project].append(stats.added)
+        label_deletions_by_project[triple.project].append(stats.deleted)
+        label_modifications_by_project[triple.project].append(stats.modified)
+        label_modifications_positive_by_project[triple.project].append(
+            stats.modified_positive
         )
-        label_additions_by_project.setdefault(triple.project, []).append(
-            added_labels(triple.training_graph, triple.test_graph)
-        )
-        label_deletions_by_project.setdefault(triple.project, []).append(
-            deleted_labels(triple.training_graph, triple.test_graph)
-        )
-        label_modifications_by_project.setdefault(triple.project, []).append(
-            modified_labels(triple.training_graph, triple.test_graph)
-        )
-        label_modifications_positive_by_project.setdefault(triple.project, []).append(
-            modified_labels_positive(triple.training_graph, triple.test_graph)
-        )
-        label_modifications_negative_by_project.setdefault(triple.project, []).append(
-            modified_labels_negative(triple.training_graph, triple.test_graph)
+        label_modifications_negative_by_project[triple.project].append(
+            stats.modified_negative
         )
+    for key, value in carry_by_project.items():
+        dataset_sizes_by_project[key].append(value)
     # We generate a graph for every project, plus an overview graph.
     for project in dataset_sizes_by_project:
         fig = make_plots(
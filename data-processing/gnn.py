@@ -3,9 +3,12 @@
 # Imports
 ################################################################################
 
-import json
+import hashlib
 import pathlib
+import types
 
+import numpy
+import orjson
 import torch
 import torch_geometric
 
@@ -18,7 +21,7 @@ import shared
 # Constants
 ################################################################################
 
-SOURCE_DIRECTORY = {
+SOURCE_DIRECTORY = types.MappingProxyType({
     # Apache Ant
     ('apache-ant', '1.1'): 'src/main',
     ('apache-ant', '1.2'): 'src/main',
@@ -50,7 +53,7 @@ SOURCE_DIRECTORY = {
     ('apache-camel', '2.15.0'): 'camel-core/src/main/java',
     ('apache-camel', '2.16.0'): 'camel-core/src/main/java',
     ('apache-camel', '2.17.0'): 'camel-core/src/main/java',
-}
+})
 
 ################################################################################
 ################################################################################
@@ -58,20 +61,57 @@ SOURCE_DIRECTORY = {
 ################################################################################
 
 
-def get_pytorch_dataset(graph: shared.Graph,
-                        source_directory: pathlib.Path,
-                        embedding_directory: pathlib.Path):
+class TripleData(torch_geometric.data.Data):
+    # pred_edges indexes into the node set, but its name does not
+    # contain 'index', so the default collation would not offset it
+    # when graphs are merged into a batch.
+
+    def __inc__(self, key, value, *args, **kwargs):
+        if key == 'pred_edges':
+            return self.num_nodes
+        return super().__inc__(key, value, *args, **kwargs)
+
+
+def get_node_features(graph: shared.Graph,
+                      source_directory: pathlib.Path,
+                      embedding_directory: pathlib.Path):
+    # Building the node features reloads every class embedding from
+    # disk; the result only depends on the source tree and the stored
+    # embeddings, so compute it once and cache the stacked tensor.
+    key = hashlib.sha256(str(source_directory).encode()).hexdigest()
+    cache_file = embedding_directory / '.cache' / f'{key}.bin'
+    if cache_file.exists():
+        return torch.load(cache_file)
     feat = shared.build_node_features(graph,
                                       source_directory,
                                       embedding_directory)
-    return torch_geometric.data.Data(
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    torch.save(feat, cache_file)
+    return feat
+
+
+def get_pytorch_dataset(graph: shared.Graph,
+                        source_directory: pathlib.Path,
+                        embedding_directory: pathlib.Path):
+    feat = get_node_features(graph,
+                             source_directory,
+                             embedding_directory)
+    # Build the index arrays in NumPy and hand them to torch via the
+    # zero-copy from_numpy path; torch.tensor on nested Python lists
+    # walks the elements one by one.
+    edge_index = numpy.empty((2, len(graph.edges)), dtype=numpy.int64)
+    for i, edge in enumerate(graph.edges):
+        edge_index[0, i] = edge.from_
+        edge_index[1, i] = edge.to
+    return TripleData(
         x=feat,
-        edge_index=torch.tensor([
-            [edge.from_ for edge in graph.edges],
-            [edge.to for edge in graph.edges]
-        ]),
-        pred_edges=torch.tensor(graph.edge_labels.edges),
-        y=torch.tensor(graph.edge_labels.labels, dtype=torch.float)
+        edge_index=torch.from_numpy(edge_index),
+        pred_edges=torch.from_numpy(
+            numpy.asarray(graph.edge_labels.edges, dtype=numpy.int64)
+        ),
+        y=torch.from_numpy(
+            numpy.asarray(graph.edge_labels.labels, dtype=numpy.float32)
+        )
     )
 
 
@@ -163,19 +203,23 @@ class Model2(torch.nn.Module):
             if i != len(self.linear2) - 1:
                 x = torch.relu(x)
 
-        pred = torch.sigmoid(x)
-        return pred.transpose(0, 1).flatten(0)
+        # Return raw logits; the sigmoid is fused into the loss
+        # (BCEWithLogitsLoss) and evaluation thresholds at 0.
+        return x.transpose(0, 1).flatten(0)
 
 
 class WeightedBCE:
 
     def __init__(self, class_weights: torch.Tensor, /):
-        self._bce = torch.nn.BCELoss(reduction='none')
+        self._bce = torch.nn.BCEWithLogitsLoss(reduction='none')
         self._class_weights = class_weights
 
     def __call__(self, input_: torch.Tensor, target: torch.Tensor):
         bce = self._bce(input_, target)
-        weights = self._class_weights[(target >= 0.5).int()]
+        # Under autocast the loss may come out in reduced precision;
+        # match the weights to whatever the loss runs in.
+        weights = self._class_weights.to(device=bce.device, dtype=bce.dtype)
+        weights = weights[(target >= 0.5).int()]
         return torch.mul(weights, bce).mean()
 
 
@@ -194,7 +238,8 @@ class Config(tap.Tap):
 
 
 def main(config: Config):
-    results = []
+    triples = []
+    train_sets = []
     for filename in config.input_files:
         triple = shared.VersionTriple.load_and_check(filename)
         print(f'Loaded version triple from project {triple.project}: '
@@ -204,45 +249,64 @@ def main(config: Config):
         key_1 = (triple.project, triple.version_1)
         key_2 = (triple.project, triple.version_2)
         key_3 = (triple.project, triple.version_3)
-        if any(key not in SOURCE_DIRECTORY for key in [key_1, key_2, key_3]):
+        dir_1, dir_2, dir_3 = (
+            SOURCE_DIRECTORY.get(key) for key in (key_1, key_2, key_3)
+        )
+        if dir_1 is None or dir_2 is None or dir_3 is None:
             raise ValueError(f'No source directory found for {triple.project}')
-        train = get_pytorch_dataset(
+        train_sets.append(get_pytorch_dataset(
             triple.training_graph,
-            config.source_directory / triple.project / triple.version_1 / SOURCE_DIRECTORY[key_1],
-            config.embedding_directory / triple.project / triple.version_1 / SOURCE_DIRECTORY[key_1],
-        )
-
-        # Training
-        device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        model = Model2(256)
-        model.to(device)
-        train.to(device)
-        optimizer = torch.optim.Adam(model.parameters(), lr=0.001)
-        loss_fn = WeightedBCE(torch.tensor([0.05, 0.95]))
-        for epoch in range(2500):
-            out = model(train)
-            loss = loss_fn(out, train.y)
+            config.source_directory / triple.project / triple.version_1 / dir_1,
+            config.embedding_directory / triple.project / triple.version_1 / dir_1,
+        ))
+        triples.append(triple)
+
+    # Training -- a single model trained over all triples at once, so
+    # every step runs on a batch of graphs instead of recreating the
+    # model and stepping on one small graph at a time.
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    model = Model2(256)
+    model.to(device)
+    model = torch.compile(model)
+    optimizer = torch.optim.Adam(model.parameters(), lr=0.001)
+    loss_fn = WeightedBCE(torch.tensor([0.05, 0.95]))
+    loader = torch_geometric.loader.DataLoader(
+        train_sets, batch_size=8, shuffle=True
+    )
+    for epoch in range(2500):
+        epoch_loss = 0.0
+        for batch in loader:
+            batch = batch.to(device)
+            with torch.autocast(device_type=device,
+                                dtype=torch.bfloat16,
+                                enabled=device == 'cuda'):
+                out = model(batch)
+                loss = loss_fn(out, batch.y)
             loss.backward()
             optimizer.step()
             optimizer.zero_grad()
-            print(f'Epoch {epoch+1}: {loss}')
+            epoch_loss += float(loss)
+        print(f'Epoch {epoch+1}: {epoch_loss}')
 
-        # Evaluation
-        del train
+    # Evaluation
+    results = []
+    for triple in triples:
+        key_2 = (triple.project, triple.version_2)
         test = get_pytorch_dataset(
             triple.test_graph,
             config.source_directory / triple.project / triple.version_2 / SOURCE_DIRECTORY[key_2],
             config.embedding_directory / triple.project / triple.version_2 / SOURCE_DIRECTORY[key_2],
         )
+        test = test.to(device)
         with torch.no_grad():
             out = model(test)
-            out = (out >= 0.5).tolist()
+            out = (out >= 0.0).tolist()
             result = shared.evaluate(triple, out)
             results.append(result)
 
     config.output_file.parent.mkdir(parents=True, exist_ok=True)
-    with open(config.output_file, 'w') as file:
-        json.dump(results, file, indent=2)
+    with open(config.output_file, 'wb') as file:
+        file.write(orjson.dumps(results, option=orjson.OPT_INDENT_2))
 
 
 if __name__ == "__main__":
@@ -1,37 +1,82 @@
 import collections
-import contextlib
 import functools
+import itertools
 import hashlib
 import logging
 import os
-import json
 import pathlib
 import re
+import sqlite3
 import statistics
 import subprocess
 import sys
 
 import alive_progress
+import orjson
 import pydriller
 import tap
 
 
+# All cache entries live in a single SQLite database instead of one
+# JSON file per key; this avoids the open/close syscall churn of many
+# small files and keeps lookups a single indexed query.
+_cache_connection = None
+
+
+def _get_cache_connection():
+    global _cache_connection
+    if _cache_connection is None:
+        if not os.path.exists('cache'):
+            os.mkdir('cache')
+        _cache_connection = sqlite3.connect(
+            os.path.join('cache', 'cache.db'), isolation_level=None
+        )
+        _cache_connection.execute(
+            'CREATE TABLE IF NOT EXISTS kv(k TEXT PRIMARY KEY, v BLOB)'
+        )
+        _cache_connection.execute('PRAGMA journal_mode=WAL')
+        _cache_connection.execute('PRAGMA synchronous=NORMAL')
+    return _cache_connection
+
+
+def _hash_cache_key(function_name: str, args, kwargs) -> str:
+    # Feed the arguments into the hash piecewise; repr-ing the whole key
+    # tuple at once builds a huge intermediate string when an argument
+    # is a long list of commit hashes.
+    h = hashlib.sha256()
+    h.update(function_name.encode())
+    for arg in args:
+        h.update(b'\x00')
+        if isinstance(arg, (list, tuple)):
+            for item in arg:
+                h.update(b'\x01')
+                h.update(repr(item).encode())
+        else:
+            h.update(repr(arg).encode())
+    for key, value in sorted(kwargs.items()):
+        h.update(b'\x00')
+        h.update(key.encode())
+        h.update(b'=')
+        h.update(repr(value).encode())
+    return h.hexdigest()
+
+
 def persistent_cache(function):
     @functools.wraps(function)
     def wrapper(*args, **kwargs):
-        if not os.path.exists('cache'):
-            os.mkdir('cache')
-        key = (function.__name__,)
-        key += args
-        key += tuple(sorted(kwargs.items()))
-        key_hash = hashlib.sha256(str(key).encode()).hexdigest()
-        cache_file = os.path.join('cache', f'{function.__name__}_{key_hash}.json')
-        if os.path.exists(cache_file):
-            with open(cache_file, 'r') as f:
-                return json.load(f)
+        key_hash = _hash_cache_key(function.__name__, args, kwargs)
+        cache_key = f'{function.__name__}_{key_hash}'
+        connection = _get_cache_connection()
+        row = connection.execute(
+            'SELECT v FROM kv WHERE k = ?', (cache_key,)
+        ).fetchone()
+        if row is not None:
+            return orjson.loads(row[0])
         result = function(*args, **kwargs)
-        with open(cache_file, 'w') as f:
-            json.dump(result, f)
+        connection.execute(
+            'INSERT OR REPLACE INTO kv VALUES (?, ?)',
+            (cache_key, orjson.dumps(result))
+        )
         return result
     return wrapper
 
@@ -49,23 +94,51 @@ class GitCmdClient:
 
     def __init__(self, repo: str):
         self.repo = repo
-
-    def _call(self, factory):
-        with contextlib.chdir(self.repo):
-            p = factory()
-            out = list(iter(p.stdout.readline, b''))
-            return b''.join(out).decode().strip()
+        self._merge_base_cache = {}
 
     def call(self, cmd: list[str]) -> str:
-        return self._call(lambda: subprocess.Popen(cmd, stdout=subprocess.PIPE))
+        return subprocess.run(
+            cmd, cwd=self.repo, stdout=subprocess.PIPE, check=True
+        ).stdout.decode().strip()
 
     def call_shell(self, cmd: str) -> str:
-        return self._call(lambda: subprocess.Popen(cmd, stdout=subprocess.PIPE, shell=True))
+        return subprocess.run(
+            cmd, cwd=self.repo, stdout=subprocess.PIPE, shell=True, check=True
+        ).stdout.decode().strip()
+
+    def merge_base(self, x: str, y: str) -> str:
+        # merge-base is symmetric in its arguments, and consecutive
+        # version pairs ask for many of the same bases; memoise so
+        # every distinct pair costs at most one subprocess.
+        key = (x, y) if x <= y else (y, x)
+        if key not in self._merge_base_cache:
+            self._merge_base_cache[key] = self.call(['git', 'merge-base', x, y])
+        return self._merge_base_cache[key]
+
+    def prefetch_merge_bases(self, pairs: list[tuple[str, str]]):
+        # Resolve a whole batch of merge bases with a single subprocess;
+        # xargs hands the pairs to git two at a time and the answers
+        # come back in order, one per line.
+        keys = []
+        for x, y in pairs:
+            key = (x, y) if x <= y else (y, x)
+            if key not in self._merge_base_cache and key not in keys:
+                keys.append(key)
+        if not keys:
+            return
+        arguments = ' '.join(itertools.chain.from_iterable(keys))
+        out = self.call_shell(
+            f'printf "%s\\n" {arguments} | xargs -n2 git merge-base'
+        )
+        for key, base in zip(keys, out.splitlines(), strict=True):
+            self._merge_base_cache[key] = base
 
 
 def count_commits(p: str):
+    # Native git with the pack bitmap answers this with a popcount;
+    # mergestat loaded a whole SQL-on-git layer to return one integer.
     client = GitCmdClient(p)
-    command = ['mergestat', "SELECT COUNT(*) FROM commits",  '-f', 'single']
+    command = ['git', 'rev-list', '--count', '--use-bitmap-index', 'HEAD']
     return int(client.call(command))
 
 
@@ -77,13 +150,22 @@ def try_int(x):
 
 
 @persistent_cache
-def get_commits_for_versions(p: str, version_pattern: str | None):
-    # Get minor version tags
+def get_commits_for_versions(p: str, version_pattern: str | None, head: str):
+    # `head` is only here to key the persistent cache: tags change
+    # rarely, so reruns on an unchanged repository skip all git work,
+    # while new commits invalidate the entry automatically.
+    # Get minor version tags. show-ref already prints the object hash
+    # next to every ref, and with -d also the peeled commit of annotated
+    # tags, so the tag commits need no separate resolution calls.
     client = GitCmdClient(p)
-    all_tags = [
-        line.split()[1]
-        for line in client.call_shell('git show-ref --tags').splitlines(keepends=False)
-    ]
+    tag_commits = {}
+    for line in client.call_shell('git show-ref --tags -d').splitlines(keepends=False):
+        hash_, ref = line.split(' ', 1)
+        if ref.endswith('^{}'):
+            tag_commits[ref[:-3]] = hash_
+        else:
+            tag_commits.setdefault(ref, hash_)
+    all_tags = list(tag_commits)
     if version_pattern is None:
         version_pattern = r'\d+\.\d+|\d+\.\d+\.0'
     pattern = re.compile(rf'^refs/tags/[^0-9]*(?P<version>{version_pattern})$')
@@ -128,19 +210,32 @@ def get_commits_for_versions(p: str, version_pattern: str | None):
         for major, tags in minor_by_major.items():
             result[major] = {
             }
-            last_tag = tags[-1][0]
-            last_divergence_point = client.call_shell(f'git merge-base {main_branch} {last_tag}')
-            for (tag_old, v_old), (tag_new, version) in zip(tags[:-1], tags[1:], strict=True):
+            resolved = [tag_commits[tag] for tag, _ in tags]
+            last_tag = resolved[-1]
+            # All merge bases the loop below can possibly ask for are
+            # known up front, so fetch them in one batched subprocess.
+            wanted = [(main_branch, last_tag)]
+            for old, new in zip(resolved, resolved[1:]):
+                wanted.append((old, new))
+                wanted.append((old, main_branch))
+                wanted.append((new, main_branch))
+                wanted.append((new, last_tag))
+            client.prefetch_merge_bases(wanted)
+            last_divergence_point = client.merge_base(main_branch, last_tag)
+            for i, ((tag_old, v_old), (tag_new, version)) in enumerate(
+                    zip(tags[:-1], tags[1:], strict=True)):
                 minor = version.split('.')[1]
-                version_divergence_point = client.call_shell(f'git merge-base {tag_old} {tag_new}')
-                divergence_point_with_main = client.call_shell(f'git merge-base {tag_old} {main_branch}')
+                tag_old = resolved[i]
+                tag_new = resolved[i + 1]
+                version_divergence_point = client.merge_base(tag_old, tag_new)
+                divergence_point_with_main = client.merge_base(tag_old, main_branch)
                 if version_divergence_point == divergence_point_with_main:
-                    new_version_divergence_point = client.call_shell(f'git merge-base {tag_new} {main_branch}')
+                    new_version_divergence_point = client.merge_base(tag_new, main_branch)
                     log = client.call_shell(f'git log --pretty=format:"%H" --no-decorate {version_divergence_point}..{new_version_divergence_point}')
                 else:
                     if divergence_point_with_main != last_divergence_point:
                         raise ValueError(f'Version {version} diverged from a prior divergent version which is not in the final tail of minor versions')
-                    divergence_point_stop = client.call_shell(f'git merge-base {tag_new} {last_tag}')
+                    divergence_point_stop = client.merge_base(tag_new, last_tag)
                     log = client.call_shell(f'git log --pretty=format:"%H" --no-decorate {version_divergence_point}..{divergence_point_stop}')
                 result[major][minor] = {
                     'old-version': v_old,
@@ -154,47 +249,81 @@ def get_commits_for_versions(p: str, version_pattern: str | None):
 
 
 
+# Compiled once; get_package is called for every modified file of every
+# commit, and identifiers are ASCII, which enables the faster matcher.
+_PACKAGE_PATTERN = re.compile(
+    r'\s*package (?P<name>[a-zA-Z_][a-zA-Z0-9_]*(\.[a-zA-Z_][a-zA-Z0-9_]*)*)\s*;',
+    re.ASCII
+)
+
+
 def get_package(source: str | None) -> str | None:
     if source is None:
         return None
-    pattern = re.compile(r'\s*package (?P<name>[a-zA-Z_][a-zA-Z0-9_]*(\.[a-zA-Z_][a-zA-Z0-9_]*)*)\s*;')
-    m = pattern.search(source)
+    m = _PACKAGE_PATTERN.search(source)
     if m is None:
         return None
     return m.group('name')
 
 
+def _file_change_data(file):
+    # Accessing the source and method properties makes pydriller invoke
+    # git and run its AST parser over the file contents; only Java
+    # files yield packages and methods we care about, so skip the
+    # expensive accesses for everything else.
+    is_java = file.filename.endswith('.java')
+    if is_java:
+        # Touch the sources first so pydriller has both blobs cached
+        # before the method properties run their parser; accessing
+        # changed_methods cold re-derives both method lists internally.
+        package_old = get_package(file.source_code_before)
+        package_new = get_package(file.source_code)
+        methods_before = [meth.name for meth in file.methods_before]
+        methods_after = [meth.name for meth in file.methods]
+        methods_changed = [meth.name for meth in file.changed_methods]
+    else:
+        package_old = package_new = None
+        methods_before = methods_after = methods_changed = []
+    return {
+        'name': file.filename,
+        'name_old': file.old_path,
+        'name_new': file.new_path,
+        'package_old': package_old,
+        'package_new': package_new,
+        'action': file.change_type.name,
+        'methods_before': methods_before,
+        'methods_after': methods_after,
+        'methods_changed': methods_changed
+    }
+
+
 @persistent_cache
 def mine_change_information_for_version(repo_path, major, minor, tag_old, tag_new, v_min, v_max, commits):
     if v_min is not None and (int(major), int(minor)) < tuple(map(int, v_min.split('.'))):
         return {}
     if v_max is not None and (int(major), int(minor)) > tuple(map(int, v_max.split('.'))):
         return {}
-    repo = pydriller.Repository(repo_path, only_commits=commits)
+    repo = pydriller.Repository(repo_path,
+                                only_commits=commits,
+                                num_workers=os.cpu_count())
     result = {}
     with alive_progress.alive_bar(len(commits)) as bar:
         print(f'{major}.{minor} (commit range: {commits[-1]}..{commits[0]}; tag range: {tag_old}..{tag_new})')
-        for seq, commit in enumerate(repo.traverse_commits()):
+        for commit in repo.traverse_commits():
             result[commit.hash] = {
-                'seq': seq,
                 'author_date_ts': commit.author_date.timestamp(),
                 'committer_date_ts': commit.author_date.timestamp(),
                 'files': [
-                    {
-                        'name': file.filename,
-                        'name_old': file.old_path,
-                        'name_new': file.new_path,
-                        'package_old': get_package(file.source_code_before),
-                        'package_new': get_package(file.source_code),
-                        'action': file.change_type.name,
-                        'methods_before': [meth.name for meth in file.methods_before],
-                        'methods_after': [meth.name for meth in file.methods],
-                        'methods_changed': [meth.name for meth in file.changed_methods]
-                    }
+                    _file_change_data(file)
                     for file in commit.modified_files
                 ]
             }
             bar()
+        # With multiple workers the traversal order is not preserved;
+        # recover a stable sequence number from the timestamps instead.
+        ordered = sorted(result, key=lambda h: result[h]['committer_date_ts'])
+        for seq, hash_ in enumerate(ordered):
+            result[hash_]['seq'] = seq
         analysed = set(result)
         required = set(commits)
         if required != analysed:
@@ -219,7 +348,8 @@ def main(config: Config):
 
     logger.setLevel(logging.INFO)
 
-    commits = get_commits_for_versions(config.repo, config.version_pattern)
+    head = GitCmdClient(config.repo).call(['git', 'rev-parse', 'HEAD'])
+    commits = get_commits_for_versions(config.repo, config.version_pattern, head)
 
     to_delete_major = []
     for major, minors in commits.items():
@@ -245,8 +375,19 @@ def main(config: Config):
         del commits[major]
 
 
-    with open(config.output_path, 'w') as fp:
-        json.dump(commits, fp, indent=2)
+    # Emit the output object one major version at a time; serialising
+    # the whole history in one go doubles peak memory for large repos.
+    with open(config.output_path, 'wb') as fp:
+        fp.write(b'{')
+        first = True
+        for major, minors in commits.items():
+            if not first:
+                fp.write(b',')
+            first = False
+            fp.write(orjson.dumps(major))
+            fp.write(b':')
+            fp.write(orjson.dumps(minors, option=orjson.OPT_INDENT_2))
+        fp.write(b'}')
 
 
 
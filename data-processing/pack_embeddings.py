@@ -0,0 +1,50 @@
+import pathlib
+
+import numpy
+import orjson
+import tap
+import torch
+
+
+class Config(tap.Tap):
+    embedding_root: pathlib.Path
+
+    def configure(self):
+        self.add_argument('-e', '--embedding_root')
+
+
+@torch.no_grad()
+def main(config: Config):
+    # Concatenate every per-class embedding into one .npy plus a
+    # relpath -> row manifest. Downstream scripts then serve all reads
+    # from a single memory-mapped array instead of one file open and
+    # pickle deserialization per class.
+    # Only the per-class embeddings are packed; the trees also hold
+    # 2-D node-feature tensors under .cache/ which must not end up in
+    # the store.
+    paths = sorted(
+        path.relative_to(config.embedding_root)
+        for path in config.embedding_root.rglob('*.java.bin')
+    )
+    if not paths:
+        raise ValueError(f'No embeddings found in {config.embedding_root}')
+    manifest = {}
+    rows = []
+    for path in paths:
+        array = torch.load(config.embedding_root / path).cpu().detach().numpy()
+        if array.ndim != 1:
+            # Anything but a single row would silently shift every
+            # later manifest index.
+            raise ValueError(
+                f'Expected a 1-D embedding in {path}, got shape {array.shape}'
+            )
+        manifest[str(path)] = len(rows)
+        rows.append(array)
+    numpy.save(config.embedding_root / 'embeddings.npy', numpy.vstack(rows))
+    with open(config.embedding_root / 'embeddings.json', 'wb') as file:
+        file.write(orjson.dumps(manifest))
+    print(f'Packed {len(rows)} embeddings into {config.embedding_root}')
+
+
+if __name__ == '__main__':
+    main(Config().parse_args())
@@ -2,9 +2,9 @@ import collections
 import json
 import os
 import pathlib
-import statistics
 import sys
 
+import numpy
 import pandas
 import tap
 
@@ -43,13 +43,12 @@ def main(conf: Config):
         with open(filename) as file:
             data = json.load(file)
         for metric in conf.metrics:
-            dist = [entry[metric] for entry in data['scores']]
-            dist = [x if x is not None else 0.0 for x in dist]
+            dist = numpy.asarray([
+                entry[metric] if entry[metric] is not None else 0.0
+                for entry in data['scores']
+            ])
             averages[str(filename.stem)][metric] = (
-                (
-                    sum(dist) / len(dist),
-                    statistics.stdev(dist)
-                )
+                dist.mean(), dist.std(ddof=1)
             )
             distributions[str(filename.stem)][metric] = dist
 
@@ -67,18 +66,23 @@ def main(conf: Config):
     #ax2 = fig.add_subplot(grid[1, 0])
 
 
-    df_data = {
-       'source': [],
-       'metric': [],
-        'value': []
-    }
+    # Build the long-format columns as whole arrays per (file, metric)
+    # block; appending scalar by scalar churns three Python lists.
+    df_sources = []
+    df_metrics = []
+    df_values = []
     for filename, metrics in distributions.items():
         for metric, values in metrics.items():
-            for value in values:
-                df_data['source'].append(name_mapping[filename])
-                df_data['metric'].append(metric)
-                df_data['value'].append(value)
-    df1 = pandas.DataFrame(df_data)
+            df_sources.append(
+                numpy.full(len(values), name_mapping[filename], dtype=object)
+            )
+            df_metrics.append(numpy.full(len(values), metric, dtype=object))
+            df_values.append(values)
+    df1 = pandas.DataFrame({
+        'source': numpy.concatenate(df_sources),
+        'metric': numpy.concatenate(df_metrics),
+        'value': numpy.concatenate(df_values),
+    })
     print(df1)
 
     for ax, df in zip([ax1], [df1]):
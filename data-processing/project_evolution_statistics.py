@@ -30,7 +30,8 @@ class ProjectEvolutionStatistics(pydantic.BaseModel):
 
     @classmethod
     def load_and_check(cls, filename) -> typing.Self:
-        with open(filename, 'r') as file:
+        # Bytes skip the UTF-8 decode and go straight to the Rust parser.
+        with open(filename, 'rb') as file:
             self = pydantic.TypeAdapter(cls).validate_json(file.read())
         return self
 
@@ -178,22 +179,38 @@ def bar_time_series_int(series: list[int],
     )
 
 
+_EVOLUTION_GETTERS = {
+    'vertices': (
+        operator.attrgetter('vertices_per_version'),
+        operator.attrgetter('vertex_edits_per_version')
+    ),
+    'edges': (
+        operator.attrgetter('edges_per_version'),
+        operator.attrgetter('edge_edits_per_version')
+    ),
+}
+
+
 def bar_evolution(stats: ProjectEvolutionStatistics,
                   node_or_edge: str,
                   which: str | None = None,
                   output_directory: pathlib.Path = None):
     if node_or_edge == 'vertices':
-        main_getter = operator.attrgetter('vertices_per_version')
-        edit_getter = operator.attrgetter('vertex_edits_per_version')
+        main_getter, edit_getter = _EVOLUTION_GETTERS['vertices']
     else:
-        main_getter = operator.attrgetter('edges_per_version')
-        edit_getter = operator.attrgetter('edge_edits_per_version')
+        main_getter, edit_getter = _EVOLUTION_GETTERS['edges']
     total_getter = operator.attrgetter(f'total_{which}' if which else 'total')
     add_getter = operator.attrgetter(f'added_{which}' if which else 'added')
     del_getter = operator.attrgetter(f'deleted_{which}' if which else 'deleted')
     total = [total_getter(v) for v in main_getter(stats)]
-    additions = [add_getter(v) for v in edit_getter(stats)]
-    deletions = [del_getter(v) for v in edit_getter(stats)]
+    # One walk over the edit list instead of two.
+    edits = edit_getter(stats)
+    if edits:
+        additions, deletions = (list(x) for x in zip(*(
+            (add_getter(e), del_getter(e)) for e in edits
+        )))
+    else:
+        additions, deletions = [], []
     additions.insert(0, 0)
     deletions.insert(0, 0)
     name = 'Vertices' if node_or_edge == 'vertices' else 'Edges'
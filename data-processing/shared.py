@@ -5,12 +5,16 @@
 
 from __future__ import annotations
 
+import concurrent.futures
 import enum
+import functools
 import os
 import pathlib
 import re
+import sys
 import typing
 
+import numpy
 import pydantic
 import torch
 
@@ -31,7 +35,9 @@ class VersionTriple(pydantic.BaseModel):
 
     @classmethod
     def load_and_check(cls, filename) -> typing.Self:
-        with open(filename, 'r') as file:
+        # Feed raw bytes to pydantic's Rust parser; reading as text
+        # would materialise a second full-size str just for the decode.
+        with open(filename, 'rb') as file:
             self = pydantic.TypeAdapter(cls).validate_json(file.read())
         if self.metadata.magic_number != 0x00_01_01_01:
             raise ValueError(f'Invalid magic number: {self.metadata.magic_number}')
@@ -63,17 +69,41 @@ class Graph(pydantic.BaseModel):
     directed: bool
     classes: list[Class]
 
+    # Flat structure-of-arrays views over the pydantic models; the hot
+    # paths read these contiguous buffers instead of paying per-scalar
+    # model attribute access.
+    @functools.cached_property
+    def node_names(self) -> list[str]:
+        # Interned once so the per-edge dict lookups downstream hit
+        # CPython's pointer-equality fast path.
+        return [sys.intern(node.name) for node in self.nodes]
+
+    @functools.cached_property
+    def edges_np(self):
+        if not self.edges:
+            return numpy.empty((0, 2), dtype=numpy.int64)
+        return numpy.array(
+            [(edge.from_, edge.to) for edge in self.edges],
+            dtype=numpy.int64
+        )
+
     def as_undirected_problem(self) -> typing.Self:
         if not self.directed:
             return self
-        undirected_edges = []
-        seen = set()
-        for edge in self.edges:
-            key = (edge.from_, edge.to)
-            rev_key = (edge.to, edge.from_)
-            if key not in seen and rev_key not in seen:
-                undirected_edges.append(edge.as_undirected_problem())
-                seen.add(key)
+        # Canonical-pair keys over a flat int64 array replace the
+        # per-edge tuple/set bookkeeping; only the surviving edges are
+        # rebuilt as Edge objects.
+        if self.edges:
+            arr = self.edges_np
+            n = int(arr.max()) + 1
+            keys = arr.min(axis=1) * n + arr.max(axis=1)
+            _, first = numpy.unique(keys, return_index=True)
+            first.sort()
+            undirected_edges = [
+                self.edges[i].as_undirected_problem() for i in first
+            ]
+        else:
+            undirected_edges = []
         return Graph(
             nodes=self.nodes,
             edges=undirected_edges,
@@ -102,11 +132,13 @@ class Edge(pydantic.BaseModel):
     edge_type: DependencySpec
 
     def as_undirected_problem(self) -> typing.Self:
-        return Edge(**{
-            'from': self.to,
-            'to': self.from_,
-            'edge_type': self.edge_type
-        })
+        # model_construct skips a second alias-parsing/validation pass
+        # over fields that were already validated at load time.
+        return Edge.model_construct(
+            from_=self.to,
+            to=self.from_,
+            edge_type=self.edge_type
+        )
 
 
 class NodeHierarchy(pydantic.BaseModel):
@@ -120,24 +152,39 @@ class EdgeLabels(pydantic.BaseModel):
     edges: list[tuple[int, int]]
     labels: list[bool]
 
+    @functools.cached_property
+    def edges_np(self):
+        if not self.edges:
+            return numpy.empty((0, 2), dtype=numpy.int64)
+        return numpy.asarray(self.edges, dtype=numpy.int64)
+
+    @functools.cached_property
+    def labels_np(self):
+        return numpy.fromiter(
+            self.labels, dtype=bool, count=len(self.labels)
+        )
+
     def as_undirected_problem(self) -> typing.Self:
-        lookup = {
-            (fr, to): flag
-            for (fr, to), flag in zip(self.edges, self.labels)
-        }
-        undirected_edges = []
-        seen = set()
-        undirected_labels = []
-        for (fr, to), flag in zip(self.edges, self.labels):
-            if (fr, to) not in seen and (to, fr) not in seen:
-                undirected_edges.append((fr, to))
-                seen.add((fr, to))
-                if not flag:
-                    flag = flag or lookup.get((to, fr))
-                undirected_labels.append(flag)
+        if not self.edges:
+            return EdgeLabels(edges=[], labels=[])
+        # Encode every unordered pair as a single int64 key; the first
+        # occurrence of each pair survives and its label is the OR over
+        # both directions. This keeps the whole dedup in C loops rather
+        # than per-edge dict and set operations.
+        edges = self.edges_np
+        labels = self.labels_np
+        n = int(edges.max()) + 1
+        keys = edges.min(axis=1) * n + edges.max(axis=1)
+        _, first, inverse = numpy.unique(
+            keys, return_index=True, return_inverse=True
+        )
+        flags = numpy.zeros(len(first), dtype=bool)
+        numpy.logical_or.at(flags, inverse, labels)
+        # Restore the original iteration order of the survivors.
+        order = numpy.argsort(first)
         return EdgeLabels(
-            edges=undirected_edges,
-            labels=undirected_labels,
+            edges=edges[first[order]].tolist(),
+            labels=flags[order].tolist(),
         )
 
 
@@ -160,34 +207,35 @@ class DependencyType(str, enum.Enum):
 
 def evaluate(triple: VersionTriple,
              predictions: list[bool], *,
-             limited_to: set[str] | None = None):
-    true_positives = 0
-    false_positives = 0
-    false_negatives = 0
-    true_negatives = 0
-    predicted = []
-
-    labels = triple.test_graph.edge_labels.labels
+             limited_to: set[tuple[int, int]] | None = None):
     edges = triple.test_graph.edge_labels.edges
 
-    for edge, (truth, pred) in zip(edges, zip(labels, predictions)):
-        if limited_to is not None and edge not in limited_to:
-            continue
-        if truth and pred:
-            true_positives += 1
-        elif truth and not pred:
-            false_negatives += 1
-        elif pred and not truth:
-            false_positives += 1
-        elif not truth and not pred:
-            true_negatives += 1
-        if pred:
-            predicted.append(
-                (
-                    triple.test_graph.nodes[edge[0]].name,
-                    triple.test_graph.nodes[edge[1]].name
-                )
-            )
+    # The confusion matrix is a handful of bitwise reductions once the
+    # labels and predictions live in boolean arrays.
+    truth = triple.test_graph.edge_labels.labels_np
+    pred = numpy.asarray(predictions, dtype=bool)
+    if limited_to is not None:
+        mask = numpy.fromiter(
+            (edge in limited_to for edge in edges), dtype=bool, count=len(edges)
+        )
+    else:
+        mask = numpy.ones(len(edges), dtype=bool)
+    if len(pred) != len(edges):
+        # Partial predictions cover exactly the masked edges, in edge
+        # order; scatter them into a full-length array so the bitwise
+        # reductions below line up.
+        full = numpy.zeros(len(edges), dtype=bool)
+        full[mask] = pred
+        pred = full
+    true_positives = int((truth & pred & mask).sum())
+    false_negatives = int((truth & ~pred & mask).sum())
+    false_positives = int((~truth & pred & mask).sum())
+    true_negatives = int((~truth & ~pred & mask).sum())
+    node_names = triple.test_graph.node_names
+    predicted = [
+        (node_names[edges[i][0]], node_names[edges[i][1]])
+        for i in numpy.flatnonzero(pred & mask)
+    ]
 
     return {
         'project': triple.project,
@@ -215,65 +263,109 @@ def build_node_features(graph: Graph,
                         embedding_directory: pathlib.Path):
     feature_map = {}
     file_mapping = scan_source_directory(source_directory)
+    embeddings = _prefetch_embeddings(graph, file_mapping, embedding_directory)
     for hierarchy in graph.hierarchies:
         build_node_features_recursively(
-            hierarchy, feature_map, file_mapping, graph, embedding_directory
+            hierarchy, feature_map, file_mapping, graph, embeddings
         )
     features = [feature_map[k] for k in sorted(feature_map.keys())]
     return torch.stack(features)
 
 
+def _prefetch_embeddings(graph: Graph,
+                         file_mapping: dict[str, list[pathlib.Path]],
+                         embedding_directory: pathlib.Path):
+    # All embedding files the traversal will touch are known up front,
+    # so load them on a thread pool (the disk reads release the GIL)
+    # instead of one blocking torch.load at a time.
+    paths = []
+    stack = list(graph.hierarchies)
+    while stack:
+        hierarchy = stack.pop()
+        stack.extend(hierarchy.children)
+        if hierarchy.index is not None:
+            paths.extend(file_mapping[hierarchy.name])
+    paths = list(dict.fromkeys(paths))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        loaded = executor.map(
+            lambda path: load_embedding(path, embedding_directory), paths
+        )
+        return dict(zip(paths, loaded))
+
+
 def build_node_features_recursively(
         hierarchy: NodeHierarchy,
         feature_map: dict[int, torch.Tensor],
         file_mapping: dict[str, list[pathlib.Path]],
         graph: Graph,
-        embedding_directory: pathlib.Path):
+        embeddings: dict[pathlib.Path, torch.Tensor]):
     if hierarchy.index is None:
         for child in hierarchy.children:
             build_node_features_recursively(
-                child, feature_map, file_mapping, graph, embedding_directory
+                child, feature_map, file_mapping, graph, embeddings
             )
     elif hierarchy.index not in feature_map:
         for child in hierarchy.children:
             build_node_features_recursively(
-                child, feature_map, file_mapping, graph, embedding_directory
+                child, feature_map, file_mapping, graph, embeddings
             )
-        child_features = [
-            feature_map[child.index]
-            for child in hierarchy.children
-        ]
-        class_features = [
-            load_embedding(filename, embedding_directory)
-            for  filename in file_mapping[hierarchy.name]
-        ]
-        feature_map[hierarchy.index] = torch.mean(
-            torch.stack(child_features + class_features),
-            dim=0,
-        )
+        # Accumulate a running sum instead of stacking everything into
+        # a (k, D) temporary and reducing it; the accumulator is the
+        # only allocation. The clone keeps the cached child/embedding
+        # tensors untouched.
+        acc = None
+        count = 0
+        for child in hierarchy.children:
+            feature = feature_map[child.index]
+            acc = feature.clone() if acc is None else acc.add_(feature)
+            count += 1
+        for filename in file_mapping[hierarchy.name]:
+            feature = embeddings[filename]
+            acc = feature.clone() if acc is None else acc.add_(feature)
+            count += 1
+        feature_map[hierarchy.index] = acc.div_(count)
+
+
+# Source trees are scanned more than once per run (train/test graphs,
+# visualisation); the result only depends on the directory contents.
+_scanned_directories = {}
 
 
 def scan_source_directory(path: pathlib.Path):
-    file_mapping = {}
-    scan_source_directory_recursive(path, path, file_mapping)
-    return file_mapping
+    key = str(path)
+    if key not in _scanned_directories:
+        file_mapping = {}
+        scan_source_directory_recursive(path, pathlib.Path(), file_mapping)
+        _scanned_directories[key] = file_mapping
+    return _scanned_directories[key]
+
+
+def scan_source_directory_recursive(path: pathlib.Path, relative: pathlib.Path, file_mapping):
+    # scandir hands back the file type from the directory read itself,
+    # avoiding a separate stat call per entry.
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                scan_source_directory_recursive(
+                    entry.path, relative / entry.name, file_mapping
+                )
+            elif entry.is_file(follow_symlinks=False):
+                package = scan_source_file(entry.path)
+                file_mapping.setdefault(package, []).append(relative / entry.name)
 
 
-def scan_source_directory_recursive(path: pathlib.Path, root: pathlib.Path, file_mapping):
-    for filename in os.listdir(path):
-        file_path = path / filename
-        if file_path.is_dir():
-            scan_source_directory_recursive(file_path, root, file_mapping)
-        elif file_path.is_file():
-            package = scan_source_file(file_path)
-            file_mapping.setdefault(package, []).append(file_path.relative_to(root))
+# Compiled once instead of per scanned file.
+_PACKAGE_PATTERN = re.compile(r'^\s*package\s+(?P<package>[a-zA-Z0-9_.]+);')
 
 
 def scan_source_file(path: pathlib.Path):
-    pattern = re.compile(r'^\s*package\s+(?P<package>[a-zA-Z0-9_.]+);')
     with open(path, encoding='utf-8', errors='ignore') as file:
         for line in file:
-            if (m := pattern.match(line)) is not None:
+            # Cheap literal pre-screen; the regex engine only runs on
+            # lines that can actually match.
+            if 'package' not in line:
+                continue
+            if (m := _PACKAGE_PATTERN.match(line)) is not None:
                 return m.group('package')
     raise ValueError(f'Could not find package in {path}')
 
@@ -8,13 +8,19 @@ described by in [1].
      https://doi.org/10.1016/j.engappai.2022.105209
 """
 
+import concurrent.futures
 import csv
-import json
-import math
+import functools
+import os
 import pathlib
 
+import numpy
+import threadpoolctl
+import orjson
 import tap
-from sklearn.svm import SVC
+from sklearn.kernel_approximation import Nystroem
+from sklearn.pipeline import make_pipeline
+from sklearn.svm import SVC, LinearSVC
 
 import shared
 
@@ -53,39 +59,72 @@ def load_feature_file(base_path: pathlib.Path, triple: shared.VersionTriple):
     for v in [triple.version_1, triple.version_2, triple.version_3]:
         filename = rename.get(triple.project, triple.project) + f'-{v}.json'
         path = base_path / rev_rename.get(triple.project, triple.project) / filename
-        with open(path) as file:
-            data = json.load(file)
+        with open(path, 'rb') as file:
+            data = orjson.loads(file.read())
+        link_features = data['link-features']
         edge_features = {}
-        for item in data['link-features']:
-            key = (item['from'], item['to'])
-            value = [_maybe_map(item[x][y]) for x, y in _FEATURE_ORDER]
-            edge_features[key] = value
+        if link_features:
+            # Gather indices are computed once per file, so per edge the
+            # feature extraction is two fromiter calls and two fancy
+            # gathers instead of 48 dict-hash lookups.
+            topo_idx, sem_idx = _feature_indices(link_features[0])
+            for item in link_features:
+                topo = numpy.fromiter(
+                    item['topological-features'].values(),
+                    dtype=numpy.float32,
+                    count=len(item['topological-features'])
+                )
+                sem = numpy.fromiter(
+                    item['semantic-features'].values(),
+                    dtype=numpy.float32,
+                    count=len(item['semantic-features'])
+                )
+                value = numpy.concatenate((topo[topo_idx], sem[sem_idx]))
+                value[numpy.isnan(value)] = 0.0
+                edge_features[(item['from'], item['to'])] = value
         result.append(edge_features)
     return tuple(result)
 
 
-def _maybe_map(x):
-    if math.isnan(x):
-        return 0
-    return x
+def _feature_indices(item):
+    # Integer indices mapping the dict value order onto _FEATURE_ORDER;
+    # the files are generated with a fixed schema, so the order from the
+    # first link holds for the whole file.
+    topo_keys = list(item['topological-features'])
+    sem_keys = list(item['semantic-features'])
+    topo_idx = numpy.asarray([
+        topo_keys.index(key)
+        for ns, key in _FEATURE_ORDER if ns == 'topological-features'
+    ])
+    sem_idx = numpy.asarray([
+        sem_keys.index(key)
+        for ns, key in _FEATURE_ORDER if ns == 'semantic-features'
+    ])
+    return topo_idx, sem_idx
 
 
 def graph_to_data(graph: shared.Graph, feature_map, *, test=True):
     indices = [0, 1] if not test else [2]
     keep_edges = []
     keep_labels = []
+    # Edges without feature data are dropped, so the kept set is
+    # returned as well; evaluate needs it to line the partial
+    # predictions up with the full edge list.
+    kept = set()
+    node_names = graph.node_names
     stream = zip(graph.edge_labels.edges, graph.edge_labels.labels)
     for (source, target), flag in stream:
         key = (
-            graph.nodes[source].name,
-            graph.nodes[target].name,
+            node_names[source],
+            node_names[target],
         )
         for index in indices:
             if key in feature_map[index]:
                 keep_edges.append(feature_map[index][key])
                 keep_labels.append(flag)
+                kept.add((source, target))
                 break
-    return keep_edges, keep_labels
+    return keep_edges, keep_labels, kept
 
 
 class Config(tap.Tap):
@@ -93,39 +132,111 @@ class Config(tap.Tap):
     feature_file: pathlib.Path
     output_file: pathlib.Path
     balanced: bool = False
+    exact: bool = False
 
     def configure(self) -> None:
         self.add_argument('-i', '--input_files')
         self.add_argument('-f', '--feature_file')
         self.add_argument('-o', '--output_file')
         self.add_argument('-b', '--balanced', action='store_true')
+        self.add_argument('-e', '--exact', action='store_true')
+
+
+def _build_model(balanced: bool, exact: bool):
+    class_weight = 'balanced' if balanced else None
+    if exact:
+        # The original rbf model, kept for exact replication of [1].
+        # The Gram matrix is precomputed with one BLAS GEMM (see main)
+        # instead of libsvm re-evaluating scalar rbf kernels on every
+        # SMO pass.
+        return SVC(kernel='precomputed',
+                   cache_size=1999,
+                   random_state=42,
+                   class_weight=class_weight)
+    # Approximate RBF: a Nystroem feature map feeding a linear SVM
+    # trains in linear time on BLAS instead of libsvm's scalar loop.
+    return make_pipeline(
+        Nystroem(gamma=0.01, n_components=500, random_state=42),
+        LinearSVC(dual=False, C=1.0, class_weight=class_weight),
+    )
+
+
+def _rbf_gram(x: numpy.ndarray, y: numpy.ndarray, gamma: float = 0.01):
+    # exp(-gamma * (|x|^2 + |y|^2 - 2 x.y)): one SGEMM plus an in-place
+    # exp pass. Keeping everything float32 and contiguous forces BLAS
+    # into SGEMM rather than promoting to double precision.
+    x = numpy.ascontiguousarray(x, dtype=numpy.float32)
+    y = numpy.ascontiguousarray(y, dtype=numpy.float32)
+    gram = x @ y.T
+    gram *= -2.0
+    gram += (x * x).sum(axis=1)[:, None]
+    gram += (y * y).sum(axis=1)[None, :]
+    gram *= -gamma
+    numpy.exp(gram, out=gram)
+    return gram
+
+
+def _limit_blas_threads():
+    # Keep every worker single-threaded so the pool does not
+    # oversubscribe the machine with nested BLAS threads. The limit is
+    # applied to the already-loaded runtimes: the workers are forked,
+    # so the BLAS/OpenMP libraries inherited from the parent read the
+    # *_NUM_THREADS environment variables long ago.
+    threadpoolctl.threadpool_limits(limits=1)
+
+
+def _process_triple(graph_filename: pathlib.Path,
+                    feature_file: pathlib.Path,
+                    balanced: bool,
+                    exact: bool):
+    triple = shared.VersionTriple.load_and_check(graph_filename)
+    feature_map = load_feature_file(feature_file, triple)
+    print(f'Loaded version triple from project {triple.project}: '
+          f'{triple.version_1}, {triple.version_2}, {triple.version_3}')
+
+    model = _build_model(balanced, exact)
+    features_train, labels, _ = graph_to_data(triple.training_graph, feature_map, test=False)
+    features_train = numpy.asarray(features_train)
+    if exact:
+        model.fit(
+            _rbf_gram(features_train, features_train),
+            labels
+        )
+    else:
+        model.fit(features_train, labels)
+    features, labels, kept = graph_to_data(triple.test_graph, feature_map, test=True)
+    if exact:
+        features = _rbf_gram(numpy.asarray(features), features_train)
+    predictions = model.predict(features).tolist()
+
+    return shared.evaluate(triple, predictions, limited_to=kept)
 
 
 def main(config: Config):
-    results = []
-    for graph_filename in config.input_files:
-        triple = shared.VersionTriple.load_and_check(graph_filename,)
-        feature_map = load_feature_file(config.feature_file, triple)
-        print(f'Loaded version triple from project {triple.project}: '
-              f'{triple.version_1}, {triple.version_2}, {triple.version_3}')
-
-        model_parameters = dict(kernel='rbf',
-                                cache_size=1999,
-                                random_state=42,
-                                gamma=0.01)
-        if config.balanced:
-            model_parameters['class_weight'] = 'balanced'
-        model = SVC(**model_parameters)
-        features, labels = graph_to_data(triple.training_graph, feature_map, test=False)
-        model.fit(features, labels)
-        features, labels = graph_to_data(triple.test_graph, feature_map, test=True)
-        predictions = model.predict(features).tolist()
-
-        result = shared.evaluate(triple, predictions)
-        results.append(result)
+    # The triples are fully independent, so they are fanned out over a
+    # process pool; map keeps the results in input order.
+    worker = functools.partial(
+        _process_triple,
+        feature_file=config.feature_file,
+        balanced=config.balanced,
+        exact=config.exact,
+    )
+    max_workers = min(len(config.input_files), os.cpu_count() or 1)
     config.output_file.parent.mkdir(parents=True, exist_ok=True)
-    with open(config.output_file, 'w') as file:
-        json.dump(results, file, indent=2)
+    # Every finished result goes to a .jsonl sidecar immediately, so a
+    # crash partway through keeps the completed triples; the pretty
+    # array at the end is written for downstream consumers.
+    results = []
+    with open(config.output_file.with_suffix('.jsonl'), 'wb') as stream, \
+            concurrent.futures.ProcessPoolExecutor(
+                max_workers=max_workers,
+                initializer=_limit_blas_threads) as executor:
+        for result in executor.map(worker, config.input_files):
+            stream.write(orjson.dumps(result) + b'\n')
+            stream.flush()
+            results.append(result)
+    with open(config.output_file, 'wb') as file:
+        file.write(orjson.dumps(results, option=orjson.OPT_INDENT_2))
 
 
 if __name__ == '__main__':
@@ -1,3 +1,4 @@
+import functools
 import pathlib
 
 import tap
@@ -37,6 +38,15 @@ def stats_for_graph(graph: shared.Graph):
 
 
 
+@functools.lru_cache(maxsize=None)
+def _natural_key(version: str):
+    # The same version strings recur across triples; caching avoids
+    # re-splitting and re-parsing them for every sort key.
+    return tuple(
+        int(x) if x.isdigit() else x for x in version.split('.')
+    )
+
+
 def main(config: Config):
     aggregated = {}
     labels = []
@@ -45,11 +55,7 @@ def main(config: Config):
         shared.VersionTriple.load_and_check(filename)
         for filename in config.input_files
     ]
-    loaded.sort(
-        key=lambda triple: tuple([
-            int(x) if x.isdigit() else x for x in triple.version_1.split('.')
-        ])
-    )
+    loaded.sort(key=lambda triple: _natural_key(triple.version_1))
     for triple in loaded:
         print(f'Processing {triple.project} ({triple.version_1}, {triple.version_2}, {triple.version_3})')
         labels.append('\n'.join([triple.version_1, triple.version_2, triple.version_3]))
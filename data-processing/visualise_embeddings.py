@@ -1,3 +1,4 @@
+import itertools
 import json
 import os
 import pathlib
@@ -27,18 +28,22 @@ class Node:
         return node.get_child(remainder)
 
     def apply(self, func):
-        children = {
-            k: v.apply(func)
-            for k, v in self._children.items()
-        }
-        if self.value is not None:
-            value = func(self.value, *(v.value for v in children.values()))
-        else:
-            value = None
-        node = Node()
-        node._children = children
-        node.value = value
-        return node
+        # Bottom-up in place: an explicit post-order walk replaces the
+        # recursion, which rebuilt a parallel tree with a fresh Node and
+        # child dict at every level.
+        order = []
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            stack.extend(node._children.values())
+        for node in reversed(order):
+            if node.value is not None:
+                node.value = func(
+                    node.value,
+                    *(child.value for child in node._children.values())
+                )
+        return self
 
     def as_dict(self):
         result = {}
@@ -54,22 +59,40 @@ class Node:
 
 
 
+def _make_embedding_loader(embedding_root: pathlib.Path):
+    # Prefer the consolidated store written by pack_embeddings.py: one
+    # memory-mapped array serves every read, instead of a file open and
+    # pickle deserialization per class. Without the store, each
+    # embedding is torch.load-ed individually as before.
+    manifest_path = embedding_root / 'embeddings.json'
+    if not manifest_path.exists():
+        return lambda path: torch.load(embedding_root / path)
+    with open(manifest_path, 'rb') as file:
+        manifest = json.load(file)
+    array = numpy.load(embedding_root / 'embeddings.npy', mmap_mode='r')
+    return lambda path: torch.from_numpy(
+        numpy.array(array[manifest[str(path)]])
+    )
+
+
 @torch.no_grad()
 def get_class_embeddings(source_root: pathlib.Path,
                          embedding_root: pathlib.Path):
     mapping = shared.scan_source_directory(source_root)
+    load = _make_embedding_loader(embedding_root)
     label_mapping = {}
-    embeddings = []
+    tensors = []
     labels = []
     packages = []
     for package, files in mapping.items():
         label = label_mapping.setdefault(package, len(label_mapping))
         for file in files:
-            embedding_path = embedding_root / file.with_suffix('.java.bin')
-            tensor = torch.load(embedding_path)
-            embeddings.append(tensor.cpu().detach().numpy())
+            tensors.append(load(file.with_suffix('.java.bin')))
             labels.append(label)
             packages.append(package)
+    # One stacked device-to-host transfer instead of a sync and a small
+    # allocation per class; UMAP gets the contiguous matrix directly.
+    embeddings = torch.stack(tensors).cpu().detach().numpy()
     return label_mapping, embeddings, labels
 
 
@@ -77,48 +100,63 @@ def get_class_embeddings(source_root: pathlib.Path,
 def get_package_embeddings(source_root: pathlib.Path,
                            embedding_root: pathlib.Path):
     mapping = shared.scan_source_directory(source_root)
+    load = _make_embedding_loader(embedding_root)
     # Convert to a hierarchy
     tree = Node()
     for package, files in mapping.items():
         node = tree.get_child(package.split('.'))
         node.value = [
-            torch.load(embedding_root / path.with_suffix('.java.bin')) for path in files
+            load(path.with_suffix('.java.bin')) for path in files
         ]
     # Bottom-up generation of features
-    embedding_tree = tree.apply(
-        lambda classes, *child_packages: torch.mean(
-            torch.stack(classes + list(child_packages)),
-            dim=0
-        )
-    )
+    embedding_tree = tree.apply(_mean_embedding)
     # Get package to embedding mapping
     package_mapping = embedding_tree.as_dict()
     assert '' not in package_mapping
     # Convert to appropriate output format
     label_mapping = {}
-    embeddings = []
+    embeddings = None
     labels = []
-    for package, embedding in package_mapping.items():
-        label_mapping[package] = len(label_mapping)
-        embeddings.append(embedding.cpu().detach().numpy())
-        labels.append(len(labels))
+    for row, (package, embedding) in enumerate(package_mapping.items()):
+        label_mapping[package] = row
+        if embeddings is None:
+            embeddings = numpy.empty(
+                (len(package_mapping), embedding.shape[-1]),
+                dtype=numpy.float32
+            )
+        embeddings[row] = embedding.cpu().detach().numpy()
+        labels.append(row)
     return label_mapping, embeddings, labels
 
 
+def _mean_embedding(classes, *child_packages):
+    # Accumulate a running sum instead of stacking everything into a
+    # (k, D) temporary and reducing it; the accumulator is the only
+    # allocation per package. The clone keeps the child embeddings
+    # untouched for their own parents.
+    acc = None
+    count = 0
+    for feature in itertools.chain(classes, child_packages):
+        acc = feature.clone() if acc is None else acc.add_(feature)
+        count += 1
+    return acc.div_(count)
+
+
 def get_as_predictor_embeddings(filename: pathlib.Path):
     with open(filename) as file:
         data = json.load(file)
     order = None
-    embeddings = []
+    embeddings = None
     labels = []
     label_mapping = {'not-connected': False, 'connected': True}
-    for edge in data:
+    for row, edge in enumerate(data):
         labels.append(edge['present_in_graph'])
         if order is None:
             order = list(edge['features'])
-        embeddings.append(
-            numpy.array([_get(edge['features'], f, edge) for f in order])
-        )
+            embeddings = numpy.empty(
+                (len(data), len(order)), dtype=numpy.float32
+            )
+        embeddings[row] = [_get(edge['features'], f, edge) for f in order]
     return label_mapping, embeddings, labels
 
 
@@ -137,6 +175,7 @@ class Config(tap.Tap):
     metric: str = 'euclidean'
     level: str = 'class'
     as_predictor: bool = False
+    reproducible: bool = False
 
     def configure(self):
         self.add_argument('-s', '--source_root')
@@ -145,6 +184,7 @@ class Config(tap.Tap):
         self.add_argument('-m', '--metric')
         self.add_argument('-l', '--level')
         self.add_argument('-a', '--as_predictor', action='store_true')
+        self.add_argument('-r', '--reproducible', action='store_true')
 
 
 def main(config: Config):
@@ -165,15 +205,22 @@ def main(config: Config):
     else:
         raise NotImplementedError(f'Unknown level {config.level}')
 
+    # Fixing random_state forces pynndescent onto a single thread, so
+    # the parallel nearest-neighbour search is the default and exact
+    # reproducibility is opt-in via --reproducible.
+    if config.reproducible:
+        umap_options = {'random_state': 42}
+    else:
+        umap_options = {'n_jobs': -1, 'low_memory': False}
     mapper = umap.UMAP(
         n_neighbors=10,
         min_dist=0.1,
         n_components=2,
         metric=config.metric,
-        random_state=42,
+        **umap_options,
     )
 
-    transformed = mapper.fit_transform(numpy.vstack(embeddings))
+    transformed = mapper.fit_transform(embeddings)
 
     fig, ax = pyplot.subplots(figsize=(16, 9))
     scatter = ax.scatter(transformed[:, 0], transformed[:, 1], c=labels)
@@ -220,13 +220,16 @@ def _build_module_features_recursively(structure,
             result[name] = _build_module_features_recursively(
                 sub_structure, embedding_directory, logger
             )
-        result['@value'] = torch.mean(
-            torch.stack([
-                (x['@value'] if isinstance(x, dict) else x)
-                for x in result.values()
-            ]),
-            dim=0
-        )
+        # Mean via a running sum: the accumulator is the only
+        # allocation, instead of stacking all children into a (k, D)
+        # temporary first. The clone keeps the child tensors untouched.
+        acc = None
+        count = 0
+        for x in result.values():
+            feature = x['@value'] if isinstance(x, dict) else x
+            acc = feature.clone() if acc is None else acc.add_(feature)
+            count += 1
+        result['@value'] = acc.div_(count)
         return result
 
 